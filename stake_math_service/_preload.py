@@ -0,0 +1,11 @@
+from __future__ import annotations
+
+# Preloaded by the run forkserver (see main._run_context): every /run process is forked from it and
+# starts with math-sdk already imported.
+from .runner import prewarm_imports
+
+try:
+    prewarm_imports()
+except Exception:  # noqa: BLE001
+    # a broken math-sdk install is reported by the run itself
+    pass
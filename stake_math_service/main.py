@@ -1,17 +1,30 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import mimetypes
+import multiprocessing
+import secrets
+import signal
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import forkserver
+from multiprocessing.connection import Connection
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
 import os
 
-from fastapi import FastAPI, HTTPException, Query
+import aiofiles
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-from .runner import run_pipeline, validate_game
+from .runner import RunResult, prewarm_imports, run_pipeline_child, validate_game
 from .settings import get_settings
 from .workspaces import (
     copy_template_game,
@@ -24,9 +37,36 @@ from .workspaces import (
 )
 
 
-app = FastAPI(title="Stake Math SDK Service", version="0.1.0")
+app = FastAPI(title="Stake Math SDK Service", version="0.1.0", default_response_class=ORJSONResponse)
 settings = get_settings()
 
+
+def _run_context() -> BaseContext:
+    """
+    Start method for run processes. forkserver forks every run from a clean single-threaded server
+    instead of this threaded API process, and preloads math-sdk there so runs start warm; spawn is
+    the fallback where forkserver doesn't exist.
+    """
+    try:
+        ctx = multiprocessing.get_context("forkserver")
+    except ValueError:
+        return multiprocessing.get_context("spawn")
+    ctx.set_forkserver_preload(["stake_math_service._preload"])
+    return ctx
+
+
+# Pipelines are CPU-bound and mutate interpreter-global state (sys.path, math-sdk PATH_TO_GAMES),
+# so each run gets its own process; that also lets a run be killed when it exceeds max_run_seconds.
+_run_ctx = _run_context()
+_active_runs: set[BaseProcess] = set()
+# Each in-flight run parks one thread in _collect_run; keep those off the default executor that
+# asyncio.to_thread/aiofiles share, so many long runs can't starve the file endpoints.
+_run_waiters = ThreadPoolExecutor(max_workers=settings.max_concurrent_runs, thread_name_prefix="run-wait")
+# Admission control for run processes: at most max_concurrent_runs execute and as many again may
+# wait; beyond that callers get 429 instead of piling up (each run can spawn many sim/Rust threads).
+_run_slots = asyncio.Semaphore(settings.max_concurrent_runs)
+_queued_runs = 0
+
 _cors_origins = [o.strip() for o in os.environ.get("STAKE_MATH_CORS_ORIGINS", "*").split(",") if o.strip()]
 if "*" in _cors_origins:
     allow_origins = ["*"]
@@ -39,6 +79,8 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # let browser clients read the validator and send it back as If-None-Match
+    expose_headers=["ETag"],
 )
 
 
@@ -66,6 +108,49 @@ def repo_math_sdk_dir() -> Path:
     raise RuntimeError("Cannot locate math-sdk (neither monorepo packages/math-sdk nor installed games/template).")
 
 
+@functools.lru_cache(maxsize=256)
+def _guess_type_by_suffixes(suffixes: str) -> tuple[str | None, str | None]:
+    return mimetypes.guess_type(f"f{suffixes}")
+
+
+def _guess_type(name: str) -> tuple[str | None, str | None]:
+    # Key the cache on the suffix chain (".csv", ".jsonl.zst"): artifact names vary per mode/index
+    # (lookUpTable_<mode>_<n>.csv), so a cache keyed on the full name would mostly miss.
+    return _guess_type_by_suffixes("".join(Path(name).suffixes))
+
+
+@app.on_event("startup")
+def _prewarm() -> None:
+    # load the system mime.types now rather than on the first /download
+    mimetypes.init()
+    # /validate runs in this process
+    try:
+        prewarm_imports(repo_math_sdk_dir())
+    except Exception:  # noqa: BLE001
+        # a broken math-sdk install is reported by the first /validate or /run instead
+        pass
+    # /run processes fork from the forkserver; start it (and its math-sdk preload) now
+    if _run_ctx.get_start_method() == "forkserver":
+        forkserver.ensure_running()
+
+
+class _ArtifactFileResponse(FileResponse):
+    # Artifacts (books, lookup tables) are often large; 1 MiB chunks cut per-chunk overhead vs the 64 KiB default.
+    chunk_size = 1 << 20
+
+
+def _etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag in tags or "*" in tags
+
+
 class CreateWorkspaceResponse(BaseModel):
     workspaceId: str
 
@@ -115,23 +200,85 @@ class TreeResponse(BaseModel):
     entries: list[dict[str, Any]]
 
 
+_NDJSON = "application/x-ndjson"
+
+
+_NDJSON_BATCH = 256
+
+
+def _ndjson_tree(ws_root: Path) -> Iterator[bytes]:
+    # Starlette pulls each chunk through its threadpool, so emit batches of lines rather than one
+    # tiny chunk per entry; memory stays bounded by the batch size.
+    batch: list[bytes] = []
+    for entry in iter_tree(ws_root, ws_root):
+        batch.append(orjson.dumps(entry) + b"\n")
+        if len(batch) >= _NDJSON_BATCH:
+            yield b"".join(batch)
+            batch.clear()
+    if batch:
+        yield b"".join(batch)
+
+
 @app.get("/v1/workspaces/{workspace_id}/tree", response_model=TreeResponse)
-def tree(workspace_id: str) -> TreeResponse:
+async def tree(workspace_id: str, request: Request) -> TreeResponse | Response:
+    """
+    List the workspace. Clients sending `Accept: application/x-ndjson` get one entry per line,
+    streamed as the directory walk progresses instead of a single buffered document.
+    """
     ws_root = workspace_root(settings.workspaces_dir, workspace_id)
-    if not ws_root.exists():
+    if not await asyncio.to_thread(ws_root.exists):
         raise HTTPException(status_code=404, detail="workspace not found")
-    return TreeResponse(workspaceId=workspace_id, entries=list(iter_tree(ws_root, ws_root)))
+    if _NDJSON in request.headers.get("accept", ""):
+        # Starlette iterates sync generators in its threadpool, so the walk stays off the event loop.
+        return StreamingResponse(_ndjson_tree(ws_root), media_type=_NDJSON)
+    entries = await asyncio.to_thread(lambda: list(iter_tree(ws_root, ws_root)))
+    return TreeResponse(workspaceId=workspace_id, entries=entries)
 
 
-@app.get("/v1/workspaces/{workspace_id}/file")
-def read_file(workspace_id: str, path: str = Query(min_length=1)) -> dict[str, Any]:
+@app.get("/v1/workspaces/{workspace_id}/file", response_model=None)
+async def read_file(
+    workspace_id: str, request: Request, response: Response, path: str = Query(min_length=1)
+) -> dict[str, Any] | Response:
     ws_root = workspace_root(settings.workspaces_dir, workspace_id)
-    if not ws_root.exists():
+    if not await asyncio.to_thread(ws_root.exists):
         raise HTTPException(status_code=404, detail="workspace not found")
     fp = safe_join(ws_root, path)
-    if not fp.exists() or fp.is_dir():
+    try:
+        st = await asyncio.to_thread(fp.stat)
+    except (FileNotFoundError, NotADirectoryError) as e:
+        raise HTTPException(status_code=404, detail="file not found") from e
+    if stat.S_ISDIR(st.st_mode):
         raise HTTPException(status_code=404, detail="file not found")
-    return {"path": path, "content": fp.read_text(encoding="utf-8")}
+
+    # Editors poll this endpoint; let unchanged files short-circuit to 304 without reading them.
+    etag = _etag(st)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    async with aiofiles.open(fp, "r", encoding="utf-8") as f:
+        content = await f.read()
+    response.headers["ETag"] = etag
+    return {"path": path, "content": content}
+
+
+def _replace_keeping_mode(tmp: Path, fp: Path) -> None:
+    # os.replace would otherwise leave the target with the temp file's umask-default permissions
+    try:
+        os.chmod(tmp, stat.S_IMODE(os.stat(fp).st_mode))
+    except FileNotFoundError:
+        pass
+    os.replace(tmp, fp)
+
+
+async def _write_text_atomic(fp: Path, content: str) -> None:
+    """Write to a sibling temp file and `os.replace` it over `fp`, so readers never see a partial file."""
+    tmp = fp.with_name(f".{fp.name}.{secrets.token_hex(4)}.tmp")
+    try:
+        async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
+            await f.write(content)
+        await asyncio.to_thread(_replace_keeping_mode, tmp, fp)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 
 class WriteFileRequest(BaseModel):
@@ -139,15 +286,25 @@ class WriteFileRequest(BaseModel):
 
 
 @app.put("/v1/workspaces/{workspace_id}/file")
-def write_file(workspace_id: str, path: str = Query(min_length=1), req: WriteFileRequest = ...) -> dict[str, str]:
+async def write_file(workspace_id: str, path: str = Query(min_length=1), req: WriteFileRequest = ...) -> dict[str, str]:
     ws_root = workspace_root(settings.workspaces_dir, workspace_id)
-    if not ws_root.exists():
+    if not await asyncio.to_thread(ws_root.exists):
         raise HTTPException(status_code=404, detail="workspace not found")
     fp = safe_join(ws_root, path)
-    if fp.exists() and fp.is_dir():
+    if fp == ws_root:
+        # the temp file would otherwise be created next to the workspace, outside of it
         raise HTTPException(status_code=400, detail="path is a directory")
-    fp.parent.mkdir(parents=True, exist_ok=True)
-    fp.write_text(req.content, encoding="utf-8")
+    try:
+        try:
+            await _write_text_atomic(fp, req.content)
+        except FileNotFoundError:
+            # only pay for mkdir when the parent is actually missing
+            await asyncio.to_thread(fp.parent.mkdir, parents=True, exist_ok=True)
+            await _write_text_atomic(fp, req.content)
+    except IsADirectoryError as e:
+        raise HTTPException(status_code=400, detail="path is a directory") from e
+    except (NotADirectoryError, FileExistsError) as e:
+        raise HTTPException(status_code=400, detail="a parent of path is a file") from e
     return {"path": path}
 
 
@@ -177,13 +334,40 @@ class RunRequest(BaseModel):
     rustThreads: int = 4
 
 
+def _kill_run(proc: BaseProcess) -> None:
+    try:
+        # run_pipeline_child makes the run a process group leader; take its sim workers down too
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        proc.kill()
+
+
+def _collect_run(recv: Connection, proc: BaseProcess) -> RunResult | None:
+    """Block until the run process has reported back and exited; None if it died without a result."""
+    try:
+        res = recv.recv()
+    except EOFError:
+        res = None
+    finally:
+        recv.close()
+    proc.join()
+    _active_runs.discard(proc)
+    return res
+
+
+@app.on_event("shutdown")
+def _kill_active_runs() -> None:
+    for proc in list(_active_runs):
+        _kill_run(proc)
+
+
 @app.post("/v1/workspaces/{workspace_id}/run")
-def run(workspace_id: str, req: RunRequest) -> dict[str, Any]:
+async def run(workspace_id: str, req: RunRequest) -> dict[str, Any]:
     games_root = workspace_games_root(settings.workspaces_dir, workspace_id)
-    if not games_root.exists():
+    if not await asyncio.to_thread(games_root.exists):
         raise HTTPException(status_code=404, detail="workspace not found")
 
-    res = run_pipeline(
+    kwargs = dict(
         workspace_games_root=games_root,
         game_id=req.gameId,
         run_sims=req.runSims,
@@ -196,6 +380,38 @@ def run(workspace_id: str, req: RunRequest) -> dict[str, Any]:
         profiling=req.profiling,
         rust_threads=req.rustThreads,
     )
+    global _queued_runs
+    if _run_slots.locked() and _queued_runs >= settings.max_concurrent_runs:
+        raise HTTPException(status_code=429, detail="too many runs in progress, retry later")
+    _queued_runs += 1
+    try:
+        await _run_slots.acquire()
+    finally:
+        _queued_runs -= 1
+    try:
+        recv, send = _run_ctx.Pipe(duplex=False)
+        proc = _run_ctx.Process(target=run_pipeline_child, args=(send, kwargs))
+        await asyncio.to_thread(proc.start)
+    except BaseException:
+        _run_slots.release()
+        raise
+    _active_runs.add(proc)
+    send.close()
+    done = asyncio.get_running_loop().run_in_executor(_run_waiters, _collect_run, recv, proc)
+    # The slot belongs to the process, not to this request: free it only once the run has exited.
+    done.add_done_callback(lambda _: _run_slots.release())
+    try:
+        res = await asyncio.wait_for(asyncio.shield(done), timeout=settings.max_run_seconds)
+    except TimeoutError as e:
+        # Kill the run (and wait for it) so nothing keeps writing into games/<id>/library after we answer.
+        _kill_run(proc)
+        await done
+        raise HTTPException(status_code=504, detail=f"run exceeded {settings.max_run_seconds}s") from e
+    except asyncio.CancelledError:
+        _kill_run(proc)
+        raise
+    if res is None:
+        raise HTTPException(status_code=500, detail=f"run worker died (exit code {proc.exitcode})")
     if not res.ok:
         raise HTTPException(status_code=400, detail={"error": res.error, "traceback": res.traceback})
 
@@ -215,15 +431,30 @@ def run(workspace_id: str, req: RunRequest) -> dict[str, Any]:
 
 
 @app.get("/v1/workspaces/{workspace_id}/download")
-def download_file(workspace_id: str, path: str = Query(min_length=1)) -> FileResponse:
+async def download_file(workspace_id: str, request: Request, path: str = Query(min_length=1)) -> Response:
     ws_root = workspace_root(settings.workspaces_dir, workspace_id)
-    if not ws_root.exists():
+    if not await asyncio.to_thread(ws_root.exists):
         raise HTTPException(status_code=404, detail="workspace not found")
     fp = safe_join(ws_root, path)
-    if not fp.exists() or fp.is_dir():
+    try:
+        st = await asyncio.to_thread(fp.stat)
+    except (FileNotFoundError, NotADirectoryError) as e:
+        raise HTTPException(status_code=404, detail="file not found") from e
+    if stat.S_ISDIR(st.st_mode):
         raise HTTPException(status_code=404, detail="file not found")
 
-    media_type, _ = mimetypes.guess_type(fp.name)
-    return FileResponse(path=str(fp), media_type=media_type or "application/octet-stream", filename=fp.name)
+    # Same validator as /file (FileResponse keeps an ETag header that is already set).
+    etag = _etag(st)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    media_type, _ = _guess_type(fp.name)
+    return _ArtifactFileResponse(
+        path=str(fp),
+        headers={"ETag": etag},
+        media_type=media_type or "application/octet-stream",
+        filename=fp.name,
+        stat_result=st,
+    )
 
 
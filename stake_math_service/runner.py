@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import contextlib
+import functools
 import importlib
 import os
 import sys
+import threading
 import traceback
 from dataclasses import dataclass
+from multiprocessing.connection import Connection
 from pathlib import Path
-from typing import Any
+from types import ModuleType
+from typing import Any, Iterator
 
 
 @dataclass(frozen=True)
@@ -16,41 +21,136 @@ class RunResult:
     traceback: str | None = None
 
 
-def _patch_math_sdk_paths(games_root: Path) -> None:
+# Serializes everything that touches process-wide state (PATH_TO_GAMES, sys.path, sys.modules["games.*"]).
+_RUN_LOCK = threading.Lock()
+
+
+def _patch_math_sdk_paths(games_root: Path | str) -> str:
     """
     math-sdk uses a global constant PATH_TO_GAMES = <repo>/games.
     For hosted workspaces we monkeypatch it to point at the workspace games folder.
+    Returns the previous value so callers can restore it.
     """
     from src.config import paths as sdk_paths  # type: ignore
 
+    prev = sdk_paths.PATH_TO_GAMES
     sdk_paths.PATH_TO_GAMES = str(games_root)
+    return prev
+
+
+@contextlib.contextmanager
+def _workspace_context(workspace_games_root: Path) -> Iterator[None]:
+    """Point math-sdk and the import system at a workspace while holding `_RUN_LOCK`."""
+    ws_root = str(workspace_games_root.parent)
+    with _RUN_LOCK:
+        prev_games = _patch_math_sdk_paths(workspace_games_root)
+        prev_modules = _games_modules()
+        # ensure workspace root is importable
+        sys.path.insert(0, ws_root)
+        try:
+            yield
+        finally:
+            if sys.path and sys.path[0] == ws_root:
+                sys.path.pop(0)
+            _patch_math_sdk_paths(prev_games)
+            # put back whatever `games` resolved to before (math-sdk's own package in pip installs,
+            # which repo_math_sdk_dir() uses to find the template)
+            _purge_games_modules()
+            sys.modules.update(prev_modules)
 
 
-def _import_game_classes(game_id: str) -> tuple[type[Any], type[Any]]:
-    cfg_mod = importlib.import_module(f"games.{game_id}.game_config")
-    gs_mod = importlib.import_module(f"games.{game_id}.gamestate")
-    cfg_cls = getattr(cfg_mod, "GameConfig")
-    gs_cls = getattr(gs_mod, "GameState")
+def _game_mtime_key(game_dir: Path) -> int:
+    """
+    Newest mtime (ns) across the game's Python modules, subpackages included; changes whenever
+    game code is edited. `library/` only holds pipeline outputs and is skipped.
+    """
+    latest = 0
+    root = os.fspath(game_dir)
+    outputs = os.path.join(root, "library")
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    if e.is_dir():
+                        if e.name != "__pycache__" and e.path != outputs:
+                            stack.append(e.path)
+                    elif e.name.endswith(".py"):
+                        latest = max(latest, e.stat().st_mtime_ns)
+        except FileNotFoundError:
+            # let the import below report the missing game
+            pass
+    return latest
+
+
+def _games_modules() -> dict[str, ModuleType]:
+    return {name: mod for name, mod in sys.modules.items() if name == "games" or name.startswith("games.")}
+
+
+def _purge_games_modules() -> None:
+    for name in _games_modules():
+        del sys.modules[name]
+
+
+@functools.lru_cache(maxsize=256)
+def _load_game_modules(ws_root: str, game_id: str, mtime_key: int) -> dict[str, ModuleType]:
+    """Import the game fresh and return the `games.*` modules that make it up."""
+    # `games` is shared by every workspace (and by math-sdk itself), so drop whatever an earlier
+    # workspace or an older version of this game left in the module cache before importing.
+    _purge_games_modules()
+    importlib.invalidate_caches()
+    importlib.import_module(f"games.{game_id}.game_config")
+    importlib.import_module(f"games.{game_id}.gamestate")
+    return _games_modules()
+
+
+def _import_game_classes(workspace_games_root: Path, game_id: str) -> tuple[type[Any], type[Any]]:
+    """Import (or reuse) GameConfig/GameState; the workspace root must already be on sys.path."""
+    mtime_key = _game_mtime_key(workspace_games_root / game_id)
+    modules = _load_game_modules(str(workspace_games_root.parent), game_id, mtime_key)
+    # Re-point `games.*` at this workspace on every call, cache hit or not, so lazy imports and
+    # pickling by qualified name inside math-sdk resolve to this game, not the last one imported.
+    _purge_games_modules()
+    sys.modules.update(modules)
+    cfg_cls = getattr(modules[f"games.{game_id}.game_config"], "GameConfig")
+    gs_cls = getattr(modules[f"games.{game_id}.gamestate"], "GameState")
     return cfg_cls, gs_cls
 
 
+def prewarm_imports(math_sdk_dir: Path | None = None) -> None:
+    """
+    Import the heavy math-sdk modules (numpy/pandas behind them) once, so the first /validate or
+    /run doesn't pay for it. `math_sdk_dir` is put on sys.path for the imports only; without it
+    math-sdk must already be importable (pip-installed).
+    """
+    sdk_root = str(math_sdk_dir) if math_sdk_dir is not None else None
+    with _RUN_LOCK:
+        if sdk_root is not None:
+            sys.path.insert(0, sdk_root)
+        try:
+            importlib.import_module("src.state.run_sims")
+            importlib.import_module("src.write_data.write_configs")
+            try:
+                importlib.import_module("optimization_program.run_script")
+            except Exception:  # noqa: BLE001
+                # optional (may need Rust); runs that ask for optimization import it themselves
+                pass
+        finally:
+            if sdk_root is not None and sys.path and sys.path[0] == sdk_root:
+                sys.path.pop(0)
+
+
 def validate_game(workspace_games_root: Path, game_id: str) -> RunResult:
     """
     Validate that the game can be imported and instantiated.
     This does NOT run simulations.
     """
     try:
-        _patch_math_sdk_paths(workspace_games_root)
-        # ensure workspace root is importable
-        ws_root = workspace_games_root.parent
-        sys.path.insert(0, str(ws_root))
-        try:
-            cfg_cls, gs_cls = _import_game_classes(game_id)
+        with _workspace_context(workspace_games_root):
+            cfg_cls, gs_cls = _import_game_classes(workspace_games_root, game_id)
+            # always instantiate: GameConfig reads non-Python inputs (reels/*.csv) that may have changed
             cfg = cfg_cls()
             _ = gs_cls(cfg)
-        finally:
-            if sys.path and sys.path[0] == str(ws_root):
-                sys.path.pop(0)
         return RunResult(ok=True)
     except Exception as e:  # noqa: BLE001
         return RunResult(ok=False, error=str(e), traceback=traceback.format_exc())
@@ -79,11 +179,8 @@ def run_pipeline(
             # optimization program is optional and may require Rust; keep opt toggles explicit.
             os.environ.setdefault("RUST_BACKTRACE", "1")
 
-        _patch_math_sdk_paths(workspace_games_root)
-        ws_root = workspace_games_root.parent
-        sys.path.insert(0, str(ws_root))
-        try:
-            cfg_cls, gs_cls = _import_game_classes(game_id)
+        with _workspace_context(workspace_games_root):
+            cfg_cls, gs_cls = _import_game_classes(workspace_games_root, game_id)
             config = cfg_cls()
             gamestate = gs_cls(config)
 
@@ -117,12 +214,20 @@ def run_pipeline(
 
                 create_stat_sheet(config.game_id, custom_keys=None)
 
-        finally:
-            if sys.path and sys.path[0] == str(ws_root):
-                sys.path.pop(0)
-
         return RunResult(ok=True)
     except Exception as e:  # noqa: BLE001
         return RunResult(ok=False, error=str(e), traceback=traceback.format_exc())
 
 
+def run_pipeline_child(conn: Connection, kwargs: dict[str, Any]) -> None:
+    """
+    Process target for a single /run: executes `run_pipeline(**kwargs)` and sends the RunResult
+    back over `conn`.
+    """
+    if hasattr(os, "setsid"):
+        # own process group, so a timed-out run can be killed together with its sim workers
+        os.setsid()
+    try:
+        conn.send(run_pipeline(**kwargs))
+    finally:
+        conn.close()
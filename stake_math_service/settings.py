@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import os
 from dataclasses import dataclass
 from pathlib import Path
@@ -10,14 +11,23 @@ class Settings:
     repo_root: Path
     workspaces_dir: Path
     max_run_seconds: int
+    max_concurrent_runs: int
 
 
+@functools.lru_cache(maxsize=1)
 def get_settings() -> Settings:
     # Assume service is run from repo root OR inside a container with /app as repo root.
     # We resolve relative workspace dir from current working directory.
     repo_root = Path(os.getcwd()).resolve()
     workspaces_dir = Path(os.environ.get("STAKE_MATH_WORKSPACES_DIR", ".stake-math-workspaces")).resolve()
     max_run_seconds = int(os.environ.get("STAKE_MATH_MAX_RUN_SECONDS", "120"))
-    return Settings(repo_root=repo_root, workspaces_dir=workspaces_dir, max_run_seconds=max_run_seconds)
+    default_runs = max(1, (os.cpu_count() or 2) // 2)
+    max_concurrent_runs = max(1, int(os.environ.get("STAKE_MATH_MAX_CONCURRENT_RUNS", str(default_runs))))
+    return Settings(
+        repo_root=repo_root,
+        workspaces_dir=workspaces_dir,
+        max_run_seconds=max_run_seconds,
+        max_concurrent_runs=max_concurrent_runs,
+    )
 
 
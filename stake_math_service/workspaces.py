@@ -1,21 +1,40 @@
 from __future__ import annotations
 
+import functools
 import os
+import re
 import shutil
 import uuid
 from pathlib import Path
-from typing import Iterable
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+_INIT_BYTES = b"# workspace games package\n"
+# 5 reels x 1 row placeholder symbol "A"
+_REEL_BYTES = b"A,A,A,A,A\n"
+_GAME_ID_MARKER = re.compile(rb'self\.game_id = ""')
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalized_root(root: Path) -> str:
+    return os.path.abspath(root)
 
 
 def safe_join(root: Path, *parts: str) -> Path:
-    """Join paths but prevent escaping the root."""
-    p = (root.joinpath(*parts)).resolve()
-    root_resolved = root.resolve()
-    if root_resolved == p:
-        return p
-    if root_resolved not in p.parents:
+    """
+    Join paths but prevent escaping the root.
+
+    This is a purely lexical check (no realpath/stat), so it is cheap enough to run on every request.
+    """
+    root_str = _normalized_root(root)
+    candidate = os.path.normpath(os.path.join(root_str, *parts))
+    if candidate != root_str and not candidate.startswith(root_str + os.sep):
         raise ValueError("Invalid path (escapes workspace root).")
-    return p
+    return Path(candidate)
 
 
 def new_workspace_id() -> str:
@@ -26,12 +45,34 @@ def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
+def _write_new_file(p: Path, data: bytes) -> None:
+    """Write `data` to `p` unless it already exists (O_CREAT|O_EXCL instead of a separate exists() stat)."""
+    try:
+        fd = os.open(p, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+@functools.lru_cache(maxsize=1024)
+def _workspace_root(workspaces_dir: str, workspace_id: str) -> Path:
+    return safe_join(Path(workspaces_dir), workspace_id)
+
+
+@functools.lru_cache(maxsize=1024)
+def _workspace_games_root(workspaces_dir: str, workspace_id: str) -> Path:
+    return safe_join(_workspace_root(workspaces_dir, workspace_id), "games")
+
+
 def workspace_root(workspaces_dir: Path, workspace_id: str) -> Path:
-    return safe_join(workspaces_dir, workspace_id)
+    return _workspace_root(str(workspaces_dir), workspace_id)
 
 
 def workspace_games_root(workspaces_dir: Path, workspace_id: str) -> Path:
-    return safe_join(workspace_root(workspaces_dir, workspace_id), "games")
+    return _workspace_games_root(str(workspaces_dir), workspace_id)
 
 
 def ensure_workspace_structure(workspaces_dir: Path, workspace_id: str) -> Path:
@@ -41,12 +82,59 @@ def ensure_workspace_structure(workspaces_dir: Path, workspace_id: str) -> Path:
     games_root = workspace_games_root(workspaces_dir, workspace_id)
     ensure_dir(games_root)
     # Make games a package so importlib can load games.<id> modules
-    init_py = safe_join(games_root, "__init__.py")
-    if not init_py.exists():
-        init_py.write_text("# workspace games package\n", encoding="utf-8")
+    _write_new_file(safe_join(games_root, "__init__.py"), _INIT_BYTES)
     return ws_root
 
 
+_FICLONE = getattr(fcntl, "FICLONE", None)
+
+
+def _copy_file(src: str, dst: str) -> None:
+    """
+    Copy a single file, preferring kernel-side copies.
+
+    Tries a reflink (FICLONE) first, then `os.copy_file_range`, and falls back to `shutil.copyfile`
+    when the filesystem doesn't support either (EXDEV, ENOTSUP, ...).
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        if _FICLONE is not None:
+            try:
+                fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+                return
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(src_fd).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(src_fd, dst_fd, remaining)
+                    if n == 0:
+                        break
+                    remaining -= n
+                return
+            except OSError:
+                # Unsupported here (or failed midway): rewind both files and copy in userspace.
+                fdst.truncate(0)
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _fast_copytree(src: str, dst: str) -> None:
+    """`shutil.copytree` equivalent built on `_copy_file`."""
+    os.mkdir(dst)
+    with os.scandir(src) as it:
+        for entry in it:
+            target = os.path.join(dst, entry.name)
+            if entry.is_dir():
+                _fast_copytree(entry.path, target)
+            else:
+                _copy_file(entry.path, target)
+                shutil.copystat(entry.path, target)
+    shutil.copystat(src, dst)
+
+
 def copy_template_game(
     *,
     repo_math_sdk_dir: Path,
@@ -70,38 +158,56 @@ def copy_template_game(
             raise FileExistsError(f"Game already exists: {game_id}")
         shutil.rmtree(dst_game)
 
-    shutil.copytree(src_template, dst_game)
+    # Real (reflinked where possible) copies, never symlinks: the template lives in the service image
+    # while workspaces live on the persistent volume, so links would dangle or silently change
+    # existing games when math-sdk is upgraded or the layout changes.
+    _fast_copytree(os.fspath(src_template), os.fspath(dst_game))
 
     # Ensure reels folder exists (template config references BR0.csv / FR0.csv)
     reels_dir = safe_join(dst_game, "reels")
     ensure_dir(reels_dir)
     for name in ("BR0.csv", "FR0.csv"):
-        f = safe_join(reels_dir, name)
-        if not f.exists():
-            # 5 reels x 1 row placeholder symbol "A"
-            f.write_text("A,A,A,A,A\n", encoding="utf-8")
+        _write_new_file(safe_join(reels_dir, name), _REEL_BYTES)
 
     # Auto-fill game_id in copied game_config.py to reduce footguns.
     cfg_path = safe_join(dst_game, "game_config.py")
-    if cfg_path.exists():
-        text = cfg_path.read_text(encoding="utf-8")
+    try:
+        data = cfg_path.read_bytes()
+    except FileNotFoundError:
+        pass
+    else:
         # very conservative replace: only replace the first occurrence of self.game_id = ""
-        marker = 'self.game_id = ""'
-        if marker in text:
-            text = text.replace(marker, f'self.game_id = "{game_id}"', 1)
-            cfg_path.write_text(text, encoding="utf-8")
+        m = _GAME_ID_MARKER.search(data)
+        if m is not None:
+            filled = f'self.game_id = "{game_id}"'.encode("utf-8")
+            cfg_path.write_bytes(data[: m.start()] + filled + data[m.end() :])
 
     return dst_game
 
 
-def iter_tree(root: Path, base: Path) -> Iterable[dict]:
-    """Return a JSONable directory tree."""
-    for entry in sorted(root.iterdir(), key=lambda p: (p.is_file(), p.name.lower())):
-        rel = entry.relative_to(base).as_posix()
+def _tree_sort_key(entry: os.DirEntry[str]) -> tuple[bool, str]:
+    return entry.is_file(), entry.name.casefold()
+
+
+def _sorted_scandir(path: str) -> list[os.DirEntry[str]]:
+    with os.scandir(path) as it:
+        entries = list(it)
+    entries.sort(key=_tree_sort_key)
+    return entries
+
+
+def iter_tree(root: Path, base: Path) -> Iterator[dict]:
+    """Return a JSONable directory tree (dirs first, depth-first)."""
+    prefix_len = len(os.fspath(base)) + 1
+    stack = [iter(_sorted_scandir(os.fspath(root)))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        rel = entry.path[prefix_len:].replace(os.sep, "/")
         if entry.is_dir():
             yield {"type": "dir", "path": rel}
-            yield from iter_tree(entry, base)
+            stack.append(iter(_sorted_scandir(entry.path)))
         else:
             yield {"type": "file", "path": rel, "size": entry.stat().st_size}
-
-